@@ -1,54 +1,104 @@
 import os
-import json
-import re
-from typing import List, Optional
+import logging
+import orjson
+from typing import List, Optional, Tuple
 from google import genai
 from google.genai import types
 
 from models import DailyRoutine
 from rl_models import CompletionLog, CriticEvaluation, PolicyRule
+from prompt_cache import SystemPromptCache
+from pydantic import TypeAdapter
+
+logger = logging.getLogger(__name__)
+
+
+# Built once at import so every evaluation reuses the same compiled validator
+_CRITIC_EVALUATION_ADAPTER = TypeAdapter(CriticEvaluation)
+
+# Leading byte of a UTF-16 high surrogate escape (\uD800-\uDBFF)
+_HIGH_SURROGATES = frozenset(("d8", "d9", "da", "db"))
 
 
 def _repair_truncated_json(raw: str) -> str:
     """
     Best-effort repair for JSON that was cut off mid-stream by a token limit.
-    Strategy:
-      1. Strip any trailing partial string/key.
-      2. Close every open array and object in LIFO order.
+    Strategy (single pass over the text):
+      1. Track open objects/arrays on a stack and remember the last point at
+         which every element so far was complete ("cut point").
+      2. A dangling string value is closed in place; a dangling key, a
+         trailing `,`/`:` or a half-written literal rewinds to the cut point.
+      3. Close every open array and object in LIFO order.
     Returns a string that is more likely to parse correctly.
     """
     text = raw.strip()
 
-    # Remove a trailing incomplete string value (e.g.  "category": "gene  )
-    text = re.sub(r',\s*"[^"]*$', '', text)   # dangling key-value pair
-    text = re.sub(r'"[^"]*$', '"_truncated"', text)  # dangling string value
-
-    # Track open braces/brackets and close them
-    stack = []
+    stack = []                   # matching closer for every open container
     in_string = False
+    string_is_key = False
     escape_next = False
-    for ch in text:
-        if escape_next:
-            escape_next = False
-            continue
-        if ch == '\\' and in_string:
-            escape_next = True
-            continue
-        if ch == '"':
-            in_string = not in_string
-            continue
+    escapes = []                 # start index of every `\` escape in the current string
+    expect_key = False
+    scalar_start = -1            # start index of an unquoted literal in progress
+    cut_pos, cut_depth = 0, 0    # text[:cut_pos] + closers for stack[:cut_depth] is valid
+
+    for i, ch in enumerate(text):
         if in_string:
+            if escape_next:
+                escape_next = False
+            elif ch == '\\':
+                escape_next = True
+                escapes.append(i)
+            elif ch == '"':
+                in_string = False
+                if not string_is_key:
+                    cut_pos, cut_depth = i + 1, len(stack)
             continue
-        if ch in ('{', '['):
+
+        if scalar_start >= 0 and (ch in ',:]}' or ch.isspace()):
+            cut_pos, cut_depth = i, len(stack)
+            scalar_start = -1
+
+        if ch == '"':
+            in_string = True
+            escapes.clear()
+            string_is_key = expect_key
+            expect_key = False
+        elif ch in ('{', '['):
             stack.append('}' if ch == '{' else ']')
+            expect_key = ch == '{'
+            cut_pos, cut_depth = i + 1, len(stack)
         elif ch in ('}', ']'):
             if stack and stack[-1] == ch:
                 stack.pop()
+                cut_pos, cut_depth = i + 1, len(stack)
+            expect_key = False
+        elif ch == ',':
+            expect_key = bool(stack) and stack[-1] == '}'
+        elif ch == ':' or ch.isspace():
+            pass
+        elif scalar_start < 0:
+            scalar_start = i
+
+    if in_string and not string_is_key:
+        # Dangling string value: keep the partial text and close the quote,
+        # dropping a half-written escape (`\`, `\u00`) or an unpaired high surrogate
+        end = len(text)
+        if escapes and (escape_next or (text[escapes[-1] + 1] == 'u' and end - escapes[-1] < 6)):
+            end = escapes.pop()
+        if escapes and escapes[-1] == end - 6 and text[end - 5] == 'u' and text[end - 4:end - 2].lower() in _HIGH_SURROGATES:
+            end = escapes[-1]
+        return text[:end] + '"' + ''.join(reversed(stack))
+
+    if scalar_start >= 0 and not in_string:
+        try:
+            orjson.loads(text[scalar_start:])
+            cut_pos, cut_depth = len(text), len(stack)
+        except orjson.JSONDecodeError:
+            pass   # half-written literal such as `tru` or `1.`
 
-    # Close everything that was left open (in reverse order)
-    closing = ''.join(reversed(stack))
-    text = text.rstrip(', \n\r\t') + closing
-    return text
+    # Rewind to the last complete element and close what was open there
+    return text[:cut_pos].rstrip() + ''.join(reversed(stack[:cut_depth]))
 
 
 class Critic:
@@ -57,24 +107,12 @@ class Critic:
     identifies patterns, and proposes scheduling policy rules.
     """
 
-    def __init__(self, api_key: Optional[str] = None, model: str = "gemini-2.5-flash"):
-        self.client = genai.Client(api_key=api_key)
-        self.model = model
+    # The word limits in the system prompt keep CriticEvaluation well under
+    # this; tune to P99 x 1.3 from the usage log in _parse_response
+    MAX_OUTPUT_TOKENS = 8192
 
-    def evaluate(
-        self,
-        plan: DailyRoutine,
-        completion: CompletionLog,
-        existing_rules: List[PolicyRule],
-    ) -> CriticEvaluation:
-        """Run the Critic LLM to produce an evaluation + proposed rule updates."""
-
-        existing_rules_text = "\n".join(
-            f"- [{r.category}] (confidence={r.confidence:.2f}) {r.rule_text}"
-            for r in existing_rules
-        ) or "No existing rules yet."
-
-        system_prompt = """You are the Critic in an Actor-Critic reinforcement-learning loop for a college student's daily planner called ChronoForge.
+    # Identical for every evaluation, so it is the explicitly cached prefix
+    SYSTEM_PROMPT = """You are the Critic in an Actor-Critic reinforcement-learning loop for a college student's daily planner called ChronoForge.
 
 Your job:
 1. Compare the PLANNED schedule against what the student ACTUALLY completed.
@@ -95,33 +133,116 @@ Rule guidelines:
 
 Output ONLY valid JSON matching the CriticEvaluation schema."""
 
+    def __init__(self, api_key: Optional[str] = None, model: str = "gemini-2.5-flash"):
+        self.client = genai.Client(api_key=api_key)
+        self.aio_client = self.client.aio
+        self.model = model
+        self._prompt_cache = SystemPromptCache(self.client, model)
+
+    def warm_prompt_cache(self) -> Optional[str]:
+        """Create the SYSTEM_PROMPT cache handle up front (e.g. before a batch of evaluations)."""
+        return self._prompt_cache.get(self.SYSTEM_PROMPT)
+
+    async def warm_prompt_cache_async(self) -> Optional[str]:
+        """Async twin of warm_prompt_cache()."""
+        return await self._prompt_cache.get_async(self.SYSTEM_PROMPT)
+
+    def evaluate(
+        self,
+        plan: DailyRoutine,
+        completion: CompletionLog,
+        existing_rules: List[PolicyRule],
+    ) -> CriticEvaluation:
+        """Run the Critic LLM to produce an evaluation + proposed rule updates."""
+        system_prompt, user_prompt = self._build_prompts(plan, completion, existing_rules)
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=user_prompt,
+            config=self._build_config(system_prompt, self._prompt_cache.get(system_prompt)),
+        )
+        return self._parse_response(response)
+
+    async def evaluate_async(
+        self,
+        plan: DailyRoutine,
+        completion: CompletionLog,
+        existing_rules: List[PolicyRule],
+    ) -> CriticEvaluation:
+        """Async twin of evaluate(), backed by the client's aio surface."""
+        evaluation, _ = await self.evaluate_checked_async(plan, completion, existing_rules)
+        return evaluation
+
+    async def evaluate_checked_async(
+        self,
+        plan: DailyRoutine,
+        completion: CompletionLog,
+        existing_rules: List[PolicyRule],
+    ) -> Tuple[CriticEvaluation, bool]:
+        """evaluate_async() plus whether the response needed JSON repair (i.e. may be degraded)."""
+        system_prompt, user_prompt = self._build_prompts(plan, completion, existing_rules)
+        response = await self.aio_client.models.generate_content(
+            model=self.model,
+            contents=user_prompt,
+            config=self._build_config(system_prompt, await self._prompt_cache.get_async(system_prompt)),
+        )
+        return self._parse_response_checked(response)
+
+    def _build_prompts(
+        self,
+        plan: DailyRoutine,
+        completion: CompletionLog,
+        existing_rules: List[PolicyRule],
+    ) -> Tuple[str, str]:
+        existing_rules_text = "\n".join(
+            f"- [{r.category}] (confidence={r.confidence:.2f}) {r.rule_text}"
+            for r in existing_rules
+        ) or "No existing rules yet."
+
+        system_prompt = self.SYSTEM_PROMPT
+
         user_prompt = f"""
 ## Generated Plan
-{json.dumps(plan.model_dump(), indent=2, default=str)}
+{plan.model_dump_json(indent=2)}
 
 ## User Completion Log
-{json.dumps(completion.model_dump(), indent=2, default=str)}
+{completion.model_dump_json(indent=2)}
 
 ## Existing Policy Rules
 {existing_rules_text}
 
 Evaluate the day and produce your CriticEvaluation now."""
 
-        response = self.client.models.generate_content(
-            model=self.model,
-            contents=user_prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                response_mime_type="application/json",
-                response_schema=CriticEvaluation,
-                temperature=0.4,
-                max_output_tokens=65536,   # raised from 4096 — Critic JSON can be large
-            ),
+        return system_prompt, user_prompt
+
+    def _build_config(
+        self,
+        system_prompt: str,
+        cache_name: Optional[str],
+    ) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            system_instruction=None if cache_name else system_prompt,
+            cached_content=cache_name,
+            response_mime_type="application/json",
+            response_schema=CriticEvaluation,
+            temperature=0.4,
+            max_output_tokens=self.MAX_OUTPUT_TOKENS,
         )
 
+    def _parse_response(self, response: types.GenerateContentResponse) -> CriticEvaluation:
+        """Turn a Gemini response into a CriticEvaluation, repairing truncated JSON if needed."""
+        return self._parse_response_checked(response)[0]
+
+    def _parse_response_checked(self, response: types.GenerateContentResponse) -> Tuple[CriticEvaluation, bool]:
+        """_parse_response() plus whether the repair / last-resort steps were needed."""
+        if response.usage_metadata:
+            logger.info(
+                "📊 Critic output tokens: %s/%s",
+                response.usage_metadata.candidates_token_count, self.MAX_OUTPUT_TOKENS,
+            )
+
         # ── 1. Best case: SDK already parsed into Pydantic ────────────
         if response.parsed is not None:
-            return response.parsed
+            return response.parsed, False
 
         # ── 2. Check finish reason before trying to parse text ────────
         finish_reason = None
@@ -140,20 +261,23 @@ Evaluate the day and produce your CriticEvaluation now."""
 
         # ── 3. Try parsing as-is first ────────────────────────────────
         try:
-            return CriticEvaluation.model_validate_json(raw_text)
+            return _CRITIC_EVALUATION_ADAPTER.validate_json(raw_text), False
         except Exception:
             pass
 
         # ── 4. Attempt to repair truncated JSON ───────────────────────
+        partial = None
         try:
-            repaired = _repair_truncated_json(raw_text)
-            return CriticEvaluation.model_validate_json(repaired)
-        except Exception:
-            pass
+            partial = orjson.loads(_repair_truncated_json(raw_text))
+            return _CRITIC_EVALUATION_ADAPTER.validate_python(partial), True
+        except Exception as e:
+            repair_err = e
 
         # ── 5. Last resort: extract whatever partial data we can ──────
+        # (reuses the dict parsed in step 4 rather than parsing again)
         try:
-            partial = json.loads(_repair_truncated_json(raw_text))
+            if not isinstance(partial, dict):
+                raise repair_err
             return CriticEvaluation(
                 performance_score=partial.get("performance_score", 50),
                 observations=partial.get("observations", ["Evaluation was truncated."]),
@@ -162,7 +286,7 @@ Evaluate the day and produce your CriticEvaluation now."""
                     if all(k in r for k in ("rule_id", "rule_text", "source_date"))
                 ],
                 encouragement=partial.get("encouragement", "Keep going!"),
-            )
+            ), True
         except Exception as final_err:
             raise ValueError(
                 f"Critic LLM response could not be parsed even after repair.\n"
@@ -1,19 +1,220 @@
-import json
+import os
+import orjson
+import tempfile
+import threading
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+# Every line is written as {"date": "...", ...} (patches then "_patch": true),
+# so both fields can be read off the line prefix without a full parse.
+_DATE_PREFIXES = (b'{"date": "', b'{"date":"')
+_PATCH_MARKERS = (b', "_patch": true', b',"_patch":true')
+
+
+def _line_key(line: bytes) -> Tuple[str, bool]:
+    """(date, is_patch) for one JSONL line, parsing JSON only for foreign layouts."""
+    for prefix in _DATE_PREFIXES:
+        if line.startswith(prefix):
+            end = line.find(b'"', len(prefix))
+            is_patch = any(line.startswith(m, end + 1) for m in _PATCH_MARKERS)
+            return line[len(prefix):end].decode(), is_patch
+    entry = orjson.loads(line)
+    return entry["date"], bool(entry.get("_patch"))
+
+
+# One lock per history file, shared by every HistoryManager in the process, so
+# an append and its index record land together
+_FILE_LOCKS: Dict[Path, threading.RLock] = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+
+def _file_lock(path: Path) -> threading.RLock:
+    with _FILE_LOCKS_GUARD:
+        return _FILE_LOCKS.setdefault(path.resolve(), threading.RLock())
 
 
 class HistoryManager:
+    """
+    Append-only per-user JSONL history.
+
+    Completions are never written back into their plan line; instead a small
+    `_patch` line is appended and merged onto the plan at read time. A sidecar
+    index journal (`history_<user>.idx.jsonl`, one record appended per log
+    line) maps each date to the byte offsets of its lines so per-date lookups
+    never scan the whole file. Once enough patches pile up the log is
+    compacted back into one line per entry.
+    """
+
+    COMPACT_THRESHOLD = 100
+    TAIL_BLOCK_SIZE = 64 * 1024
+
     def __init__(self, user_id: str):
         self.file_path = Path(f"history_{user_id}.jsonl")
+        self.index_path = Path(f"history_{user_id}.idx.jsonl")
         self.file_path.touch(exist_ok=True)
+        self._index: Optional[Dict] = None
+
+    # ── index maintenance ─────────────────────────────────────────────
+
+    def _get_index(self) -> Dict:
+        # Another instance may have appended since; the size check catches it
+        if self._index is not None and self._index["size"] == self.file_path.stat().st_size:
+            return self._index
+        with _file_lock(self.file_path):
+            # Re-check under the lock: a writer may have just brought it up to date
+            size = self.file_path.stat().st_size
+            if self._index is not None and self._index["size"] == size:
+                return self._index
+            if self.index_path.exists():
+                index = self._load_index()
+                # The index is only trusted if it covers the log byte-for-byte
+                if index is not None and index["size"] == size:
+                    self._index = index
+                    return index
+            return self._rebuild_index()
+
+    def _load_index(self) -> Optional[Dict]:
+        """Replay the index journal: one `[date, offset, end, is_patch]` record per log line."""
+        index = {"size": 0, "patches": 0, "dates": {}}
+        with open(self.index_path, "rb") as f:
+            for line in f:
+                try:
+                    date, offset, end, is_patch = orjson.loads(line)
+                except (ValueError, TypeError):
+                    return None   # torn final record; rebuild from the log
+                self._index_line(index, date, offset, end, is_patch)
+        return index
+
+    @staticmethod
+    def _index_line(index: Dict, date: str, offset: int, end: int, is_patch: bool) -> None:
+        index["dates"].setdefault(date, []).append(offset)
+        index["size"] = end
+        if is_patch:
+            index["patches"] += 1
+
+    def _rebuild_index(self) -> Dict:
+        """Re-scan the log and rewrite the journal; callers hold `_file_lock`."""
+        index = {"size": 0, "patches": 0, "dates": {}}
+        records = []
+        with open(self.file_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    date, is_patch = _line_key(line)
+                    records.append(orjson.dumps([date, offset, offset + len(line), is_patch]) + b"\n")
+                    self._index_line(index, date, offset, offset + len(line), is_patch)
+                offset += len(line)
+        index["size"] = offset
+        with tempfile.NamedTemporaryFile(
+            dir=self.index_path.parent, prefix=self.index_path.name, suffix=".tmp", delete=False
+        ) as tmp:
+            tmp.write(b"".join(records))
+        os.replace(tmp.name, self.index_path)
+        self._index = index
+        return index
+
+    def _append(self, entry: Dict) -> None:
+        line = orjson.dumps(entry) + b"\n"
+        is_patch = bool(entry.get("_patch"))
+        with _file_lock(self.file_path):
+            index = self._get_index()
+            with open(self.file_path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+            if offset != index["size"]:
+                # Someone else wrote in between: the cached index no longer lines up
+                self._rebuild_index()
+                return
+            record = [entry["date"], offset, offset + len(line), is_patch]
+            with open(self.index_path, "ab") as f:
+                f.write(orjson.dumps(record) + b"\n")
+            self._index_line(index, *record)
+
+    def _read_date(self, date: str) -> List[Dict]:
+        offsets = self._get_index()["dates"].get(date, [])
+        entries = []
+        with open(self.file_path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                entries.append(orjson.loads(f.readline()))
+        return self._merge(entries)
+
+    @staticmethod
+    def _merge(entries: List[Dict]) -> List[Dict]:
+        """Fold each `_patch` line onto every earlier entry for its date still missing a completion."""
+        merged: List[Dict] = []
+        awaiting: Dict[str, List[Dict]] = {}
+        for entry in entries:
+            if entry.get("_patch"):
+                for pending in awaiting.pop(entry["date"], []):
+                    pending["completion"] = entry["completion"]
+                continue
+            merged.append(entry)
+            if entry.get("completion") is None:
+                awaiting.setdefault(entry["date"], []).append(entry)
+        return merged
+
+    def _read_tail(self, days: int, before: Optional[str] = None) -> List[Dict]:
+        """
+        Parse lines backwards from EOF until `days` non-patch entries are seen
+        (only counting entries dated before `before`, if given). Patches always
+        follow the entry they complete, so everything needed to merge those
+        entries lies inside the returned tail.
+        """
+        tail: deque = deque()
+        found = 0
+        with open(self.file_path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            remainder = b""
+            while pos > 0 and found < days:
+                step = min(self.TAIL_BLOCK_SIZE, pos)
+                pos -= step
+                f.seek(pos)
+                lines = (f.read(step) + remainder).split(b"\n")
+                remainder = lines.pop(0)   # possibly partial; completed by the next block
+                for line in reversed(lines):
+                    if not line.strip():
+                        continue
+                    entry = orjson.loads(line)
+                    tail.appendleft(entry)
+                    if not entry.get("_patch") and (before is None or entry["date"] < before):
+                        found += 1
+                        if found == days:
+                            break
+            if found < days and remainder.strip():   # reached the first line of the file
+                tail.appendleft(orjson.loads(remainder))
+        return list(tail)
+
+    def compact(self) -> None:
+        """Rewrite the log with every patch folded in, then rebuild the index."""
+        with _file_lock(self.file_path):
+            with open(self.file_path, "rb") as f:
+                entries = self._merge([orjson.loads(line) for line in f if line.strip()])
+            tmp_path = self.file_path.with_suffix(".jsonl.tmp")
+            with open(tmp_path, "wb") as f:
+                for entry in entries:
+                    f.write(orjson.dumps(entry) + b"\n")
+            tmp_path.replace(self.file_path)
+            self._rebuild_index()
+
+    # ── public API ────────────────────────────────────────────────────
 
     def get_recent_history(self, days: int = 5) -> List[Dict]:
         if not self.file_path.exists():
             return []
-        with open(self.file_path, "r") as f:
-            lines = list(f)[-days:]
-            return [json.loads(line.strip()) for line in lines if line.strip()]
+        return self._merge(self._read_tail(days))[-days:]
+
+    def get_recent_and_prior_history(self, date: str, days: int = 5) -> Tuple[List[Dict], List[Dict]]:
+        """
+        (last `days` entries, last `days` entries dated strictly before `date`)
+        from a single tail read: the tail that covers the second always covers
+        the first. ISO dates compare as strings.
+        """
+        if not self.file_path.exists():
+            return [], []
+        merged = self._merge(self._read_tail(days, before=date))
+        return merged[-days:], [e for e in merged if e["date"] < date][-days:]
 
     def save_plan(self, plan: Dict, completion: Optional[Dict] = None):
         entry = {
@@ -21,41 +222,30 @@ class HistoryManager:
             "generated_plan": plan,
             "completion": completion,
         }
-        with open(self.file_path, "a") as f:
-            f.write(json.dumps(entry) + "\n")
+        self._append(entry)
 
     def save_completion(self, date: str, completion_data: Dict) -> bool:
         if not self.file_path.exists():
             return False
 
-        lines = self.file_path.read_text().strip().splitlines()
-        updated = False
-
-        with open(self.file_path, "w") as f:
-            for line in lines:
-                entry = json.loads(line)
-                if entry.get("date") == date and entry.get("completion") is None:
-                    entry["completion"] = completion_data
-                    updated = True
-                f.write(json.dumps(entry) + "\n")
+        updated = any(e.get("completion") is None for e in self._read_date(date))
 
-        if not updated:
+        if updated:
+            self._append({"date": date, "_patch": True, "completion": completion_data})
+            if self._get_index()["patches"] > self.COMPACT_THRESHOLD:
+                self.compact()
+        else:
             standalone = {
                 "date": date,
                 "generated_plan": None,
                 "completion": completion_data,
             }
-            with open(self.file_path, "a") as f:
-                f.write(json.dumps(standalone) + "\n")
+            self._append(standalone)
 
         return updated
 
     def get_entry_for_date(self, date: str) -> Optional[Dict]:
         if not self.file_path.exists():
             return None
-        with open(self.file_path, "r") as f:
-            for line in f:
-                entry = json.loads(line.strip())
-                if entry.get("date") == date:
-                    return entry
-        return None
\ No newline at end of file
+        entries = self._read_date(date)
+        return entries[0] if entries else None
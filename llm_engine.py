@@ -1,19 +1,61 @@
+import io
 import os
-import json
-from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+import httpx
+import orjson
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
 from google import genai
 from google.genai import types
 from models import (
     DailyInput, DailyRoutine, RoutineResponse, RoutineResponseData,
-    TimetableMeta, SuggestedTimetableEntry, ScheduledTask
+    TimetableMeta, SuggestedTimetableEntry, ScheduledTask, utc_timestamp
 )
-from datetime import datetime
 from schedule_fixer import build_collision_free_schedule
+from prompt_cache import SystemPromptCache
+from critic import _repair_truncated_json
+from pydantic import BaseModel, Field, TypeAdapter
 
+logger = logging.getLogger(__name__)
 
-# ── Internal LLM output schema (what the LLM actually generates) ─────
 
-from pydantic import BaseModel, Field
+def _list_json(models: List[BaseModel]) -> str:
+    """Serialize a list of models in one pydantic-core pass per item (no dict round-trip)."""
+    return "[" + ",".join(m.model_dump_json() for m in models) + "]"
+
+
+def _compact_history(history: List[Dict[str, Any]]) -> str:
+    """
+    Project history entries down to what the Actor needs to calibrate time
+    estimates — planned vs. actual minutes per task — one compact JSON line per day.
+    """
+    lines = []
+    for entry in history:
+        plan = entry.get("generated_plan") or {}
+        completion = entry.get("completion") or {}
+        day: Dict[str, Any] = {
+            "date": entry.get("date"),
+            "planned": [
+                {"task": t.get("task_name"), "planned_min": t.get("estimated_minutes")}
+                for t in plan.get("scheduled_tasks", [])
+            ],
+        }
+        if completion:
+            day["actual"] = [
+                {
+                    "task": t.get("task_name"),
+                    "actual_min": t.get("actual_minutes"),
+                    "completed": t.get("completed"),
+                    **({"skip_reason": t["skip_reason"]} if t.get("skip_reason") else {}),
+                }
+                for t in completion.get("tasks", [])
+            ]
+            day["satisfaction"] = completion.get("overall_satisfaction")
+        lines.append(orjson.dumps(day).decode())
+    return "\n".join(lines)
+
+
+# ── Internal LLM output schema (what the LLM actually generates) ─────
 
 class _LLMOutput(BaseModel):
     """Schema the LLM must return — we convert this to RoutineResponse."""
@@ -31,37 +73,37 @@ class _LLMOutput(BaseModel):
     message: str = "Timetable extracted and normalized successfully"
 
 
-class LLMScheduler:
-    def __init__(self, api_key: Optional[str] = None, model: str = "gemini-3-flash-preview"):
-        self.client = genai.Client(api_key=api_key)
-        self.model = model
+# Built once at import so every request reuses the same compiled validator
+_LLM_OUTPUT_ADAPTER = TypeAdapter(_LLMOutput)
 
-    def generate_routine(
-        self,
-        input_data: DailyInput,
-        history: List[Dict[str, Any]],
-        policy_block: str = "",
-    ) -> RoutineResponse:
-        """
-        Generate a full daily routine and return it wrapped in the new
-        RoutineResponse envelope.
-        """
 
-        archetype_note = (
-            f"\nUser archetype: {input_data.archetype}. "
-            "Tailor energy blocks and task ordering to this archetype's tendencies."
-            if input_data.archetype
-            else ""
-        )
+class LLMScheduler:
+    TEMPERATURE = 0.3
+    # Headroom over the typical 4-8k token _LLMOutput; tune to P99 x 1.3 from _log_usage
+    MAX_OUTPUT_TOKENS = 12288
+    SNAPSHOT_INTERVAL_SECONDS = 0.1
+    # One instance serves every request, so its async pool is the app's pool
+    HTTP_MAX_CONNECTIONS = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
 
-        focus_apps_note = (
-            f"\nApps to align with focus timer (block during deep-work): "
-            f"{', '.join(input_data.apps_to_align_with_focus_timer)}."
-            if input_data.apps_to_align_with_focus_timer
-            else ""
+    def __init__(self, api_key: Optional[str] = None, model: str = "gemini-3-flash-preview"):
+        self.client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(
+                async_client_args={
+                    "limits": httpx.Limits(
+                        max_connections=self.HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=self.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    )
+                }
+            ),
         )
+        self.aio_client = self.client.aio
+        self.model = model
+        self._prompt_cache = SystemPromptCache(self.client, model)
 
-        system_prompt = f"""You are ChronoForge — the ruthless AI Attention Operating System for Indian college students.
+        # System prompt pieces that never vary per request
+        self._base_system_prompt = """You are ChronoForge — the ruthless AI Attention Operating System for Indian college students.
 You generate a single, opinionated, attendance-aware daily routine that:
 - Respects 75% attendance rule (show safe skips with exact impact)
 - Fills every free slot with high-ROI micro-tasks from short/long-term goals
@@ -69,14 +111,8 @@ You generate a single, opinionated, attendance-aware daily routine that:
 - Learns from history (adjust time estimates if past tasks consistently overran)
 - Eliminates decision paralysis and black-hole free periods
 - Honours focus-timer app blocking for distraction control
-{archetype_note}
-{focus_apps_note}
 """
-
-        if policy_block:
-            system_prompt += policy_block
-
-        system_prompt += """
+        self._system_prompt_suffix = """
 You must also output a `suggested_timetable` — a week-level normalized class timetable
 derived from the user's provided timetable slots (expand per-day slots into a full weekly
 view across Monday-Saturday). Infer `institution`, `program`, `semester`, `section` from
@@ -86,47 +122,255 @@ ambiguous slots.
 Output ONLY valid JSON matching the _LLMOutput schema.
 """
 
-        history_context = "\n".join([json.dumps(h, default=str) for h in history])
+    def generate_routine(
+        self,
+        input_data: DailyInput,
+        history: List[Dict[str, Any]],
+        policy_block: str = "",
+    ) -> RoutineResponse:
+        """
+        Generate a full daily routine and return it wrapped in the new
+        RoutineResponse envelope.
+        """
+        for event, payload in self.stream_routine(input_data, history, policy_block):
+            if event == "done":
+                return payload
+        raise ValueError("LLM stream ended without producing a routine.")
+
+    def stream_routine(
+        self,
+        input_data: DailyInput,
+        history: List[Dict[str, Any]],
+        policy_block: str = "",
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Stream the routine from the LLM.
+
+        Yields ("chunk", text) for every delta received, then a single
+        ("done", RoutineResponse) once the JSON is complete and post-processed.
+        """
+        system_prompt, user_prompt = self._build_prompts(input_data, history, policy_block)
+        config = self._build_config(system_prompt, self._prompt_cache.get(system_prompt))
+
+        buffer = io.StringIO()
+        finish_reason = None
+        usage = None
+        for chunk in self.client.models.generate_content_stream(
+            model=self.model,
+            contents=user_prompt,
+            config=config,
+        ):
+            if chunk.candidates and chunk.candidates[0].finish_reason:
+                finish_reason = chunk.candidates[0].finish_reason
+            if chunk.usage_metadata:
+                usage = chunk.usage_metadata
+            if chunk.text:
+                buffer.write(chunk.text)
+                yield "chunk", chunk.text
+
+        self._log_usage(usage, finish_reason)
+        yield "done", self._build_response(buffer.getvalue(), finish_reason, input_data)
+
+    # ── Async variants (non-blocking on the FastAPI event loop) ─────
+
+    async def generate_routine_async(
+        self,
+        input_data: DailyInput,
+        history: List[Dict[str, Any]],
+        policy_block: str = "",
+    ) -> RoutineResponse:
+        """Async twin of generate_routine(), backed by the client's aio surface."""
+        async for event, payload in self.stream_routine_async(input_data, history, policy_block):
+            if event == "done":
+                return payload
+        raise ValueError("LLM stream ended without producing a routine.")
+
+    async def stream_routine_async(
+        self,
+        input_data: DailyInput,
+        history: List[Dict[str, Any]],
+        policy_block: str = "",
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Async twin of stream_routine()."""
+        system_prompt, user_prompt = self._build_prompts(input_data, history, policy_block)
+        config = self._build_config(system_prompt, await self._prompt_cache.get_async(system_prompt))
+
+        buffer = io.StringIO()
+        finish_reason = None
+        usage = None
+        async for chunk in await self.aio_client.models.generate_content_stream(
+            model=self.model,
+            contents=user_prompt,
+            config=config,
+        ):
+            if chunk.candidates and chunk.candidates[0].finish_reason:
+                finish_reason = chunk.candidates[0].finish_reason
+            if chunk.usage_metadata:
+                usage = chunk.usage_metadata
+            if chunk.text:
+                buffer.write(chunk.text)
+                yield "chunk", chunk.text
+
+        self._log_usage(usage, finish_reason)
+        yield "done", self._build_response(buffer.getvalue(), finish_reason, input_data)
+
+    async def stream_routine_snapshots(
+        self,
+        input_data: DailyInput,
+        history: List[Dict[str, Any]],
+        policy_block: str = "",
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Latest-first variant of stream_routine_async() for progress UIs.
+
+        A background task ingests deltas onto a queue; this generator wakes at
+        most every SNAPSHOT_INTERVAL_SECONDS, drains whatever arrived and, if
+        an object or array closed in it, parses the accumulated buffer once (off
+        the loop). Yields ("snapshot", _LLMOutput) for each newly parseable
+        partial, then ("done", RoutineResponse).
+        """
+        ingest_q: asyncio.Queue = asyncio.Queue()
+
+        async def _ingest():
+            try:
+                async for item in self.stream_routine_async(input_data, history, policy_block):
+                    ingest_q.put_nowait(item)
+            except Exception as e:
+                ingest_q.put_nowait(("error", e))
+
+        producer = asyncio.create_task(_ingest())
+        buffer = io.StringIO()
+        last_snapshot = None
+        try:
+            while True:
+                batch = [await ingest_q.get()]
+                await asyncio.sleep(self.SNAPSHOT_INTERVAL_SECONDS)   # coalesce bursts
+                while not ingest_q.empty():
+                    batch.append(ingest_q.get_nowait())
+
+                closed = False   # did a `}` / `]` arrive since the last parse?
+                for event, payload in batch:
+                    if event == "chunk":
+                        buffer.write(payload)
+                        closed = closed or "}" in payload or "]" in payload
+                    elif event == "error":
+                        raise payload
+                    else:
+                        yield "done", payload
+                        return
+
+                # Snapshots only gain a task when an object or array closes, so
+                # the O(n) repair+validate pass waits for one (partial strings
+                # in between aren't worth it) and runs on a worker thread so it
+                # never stalls the event loop
+                if not closed:
+                    continue
+                snapshot = await asyncio.to_thread(self._parse_partial, buffer.getvalue())
+                if snapshot is not None and snapshot != last_snapshot:
+                    last_snapshot = snapshot
+                    yield "snapshot", snapshot
+        finally:
+            producer.cancel()
+
+    @staticmethod
+    def _parse_partial(raw_text: str) -> Optional[_LLMOutput]:
+        """Best-effort parse of an incomplete stream; None until it validates."""
+        try:
+            return _LLM_OUTPUT_ADAPTER.validate_json(_repair_truncated_json(raw_text))
+        except ValueError:
+            return None
+
+    def _log_usage(self, usage: Optional[types.GenerateContentResponseUsageMetadata], finish_reason: Any) -> None:
+        """Record output size so MAX_OUTPUT_TOKENS can be tuned against real traffic."""
+        if usage is not None:
+            logger.info(
+                "📊 Actor output tokens: %s/%s (finish_reason=%s)",
+                usage.candidates_token_count, self.MAX_OUTPUT_TOKENS, finish_reason,
+            )
+
+    def _build_prompts(
+        self,
+        input_data: DailyInput,
+        history: List[Dict[str, Any]],
+        policy_block: str,
+    ) -> Tuple[str, str]:
+        """Assemble the (system_prompt, user_prompt) pair for one routine request."""
+
+        # Static prefix first so identical bytes lead every request
+        # (explicit and implicit Gemini prefix caching both key on it).
+        system_prompt = self._base_system_prompt
+        if input_data.archetype:
+            system_prompt += (
+                f"\nUser archetype: {input_data.archetype}. "
+                "Tailor energy blocks and task ordering to this archetype's tendencies.\n"
+            )
+        if input_data.apps_to_align_with_focus_timer:
+            system_prompt += (
+                f"\nApps to align with focus timer (block during deep-work): "
+                f"{', '.join(input_data.apps_to_align_with_focus_timer)}.\n"
+            )
+        if policy_block:
+            system_prompt += policy_block
+        system_prompt += self._system_prompt_suffix
+
+        personality_json = input_data.personality.model_dump_json(indent=2)
+        timetable_json = _list_json(input_data.timetable)
+        long_term_json = _list_json(input_data.long_term_goals)
+
+        history_context = _compact_history(history) if history else "No history yet."
+        deadlines_json = (
+            orjson.dumps(input_data.today_deadlines, default=str).decode()
+            if input_data.today_deadlines else "[]"
+        )
 
         user_prompt = f"""
 Date: {input_data.current_date} ({input_data.current_day})
-Personality: {input_data.personality.model_dump_json(indent=2)}
+Personality: {personality_json}
 Archetype: {input_data.archetype or "not specified"}
-Timetable: {json.dumps([s.model_dump() for s in input_data.timetable], indent=2)}
-Long-term goals: {json.dumps([g.model_dump() for g in input_data.long_term_goals], indent=2)}
-Short-term goals: {json.dumps([g.model_dump() for g in input_data.short_term_goals], indent=2)}
-Misc commitments: {json.dumps([m.model_dump() for m in input_data.misc_commitments], indent=2)}
-Apps to block during focus: {json.dumps(input_data.apps_to_align_with_focus_timer)}
-Today deadlines: {json.dumps(input_data.today_deadlines or [])}
+Timetable: {timetable_json}
+Long-term goals: {long_term_json}
+Short-term goals: {_list_json(input_data.short_term_goals)}
+Misc commitments: {_list_json(input_data.misc_commitments)}
+Apps to block during focus: {orjson.dumps(input_data.apps_to_align_with_focus_timer).decode()}
+Today deadlines: {deadlines_json}
 
 Recent History (use to calibrate estimates):
-{history_context or "No history yet."}
+{history_context}
 
 Generate today's optimised routine now. Also produce a suggested_timetable for the full week
 based on the timetable slots provided, expanding them across all weekdays logically.
 """
+        return system_prompt, user_prompt
 
-        response = self.client.models.generate_content(
-            model=self.model,
-            contents=user_prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                response_mime_type="application/json",
-                response_schema=_LLMOutput,
-                temperature=0.3,
-                max_output_tokens=65536,
-            ),
+    def _build_config(
+        self,
+        system_prompt: str,
+        cache_name: Optional[str],
+    ) -> types.GenerateContentConfig:
+        # Prefer the explicit prompt cache; Gemini rejects system_instruction
+        # alongside cached_content, so only one of the two is set.
+        return types.GenerateContentConfig(
+            system_instruction=None if cache_name else system_prompt,
+            cached_content=cache_name,
+            response_mime_type="application/json",
+            response_schema=_LLMOutput,
+            temperature=self.TEMPERATURE,
+            max_output_tokens=self.MAX_OUTPUT_TOKENS,
         )
 
-        if response.parsed is not None:
-            raw: _LLMOutput = response.parsed
-        elif response.text:
-            raw = _LLMOutput.model_validate_json(response.text)
-        else:
+    def _build_response(
+        self,
+        raw_text: str,
+        finish_reason: Any,
+        input_data: DailyInput,
+    ) -> RoutineResponse:
+        """Parse the accumulated stream once and wrap it in a RoutineResponse."""
+        if not raw_text:
             raise ValueError(
                 "LLM returned an empty or unparseable response. "
-                f"Finish reason: {response.candidates[0].finish_reason if response.candidates else 'no candidates'}"
+                f"Finish reason: {finish_reason or 'no candidates'}"
             )
+        raw = _LLM_OUTPUT_ADAPTER.validate_json(raw_text)
 
         # ── Post-process: inject classes + resolve collisions (pure logic) ──
         fixed_tasks = build_collision_free_schedule(
@@ -140,7 +384,7 @@ based on the timetable slots provided, expanding them across all weekdays logica
             program=raw.program,
             semester=raw.semester,
             section=raw.section,
-            generated_at=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            generated_at=utc_timestamp(),
             timezone=raw.timezone,
             confidence=raw.metadata_confidence_score,
         )
@@ -1,9 +1,15 @@
 import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import anyio.to_thread
 from dotenv import load_dotenv
 load_dotenv()  # Load .env before anything else
 
-from fastapi import FastAPI, HTTPException
-from typing import Dict, Any
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import Dict, Any, Set, Tuple
 
 from models import DailyInput, DailyRoutine, RoutineResponse
 from rl_models import CompletionLog, CriticEvaluation
@@ -11,17 +17,115 @@ from llm_engine import LLMScheduler
 from history_manager import HistoryManager
 from policy_store import PolicyStore
 from critic import Critic
+from routine_cache import RoutineCache
 
-app = FastAPI(title="ChronoForge Direction Engine")
+# LOG_LEVEL=DEBUG dumps full request/response payloads
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger("chronoforge")
 
-llm = LLMScheduler()
-critic = Critic()
+# Worker threads for blocking disk/SDK calls (asyncio.to_thread and Starlette's threadpool)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
+
+# Only serve cached routines when the Actor is near-deterministic
+ROUTINE_CACHE_MAX_TEMPERATURE = 0.3
+
+app = FastAPI(title="ChronoForge Direction Engine", default_response_class=ORJSONResponse)
+app.state.routine_cache = RoutineCache()
+app.state.llm = None
+app.state.critic = None
+
+
+@app.on_event("startup")
+async def _size_threadpools():
+    """Raise the default 40-thread/CPU-based caps so offloaded I/O doesn't queue."""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREADPOOL_SIZE, thread_name_prefix="dayplanner")
+    )
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+
+@app.on_event("startup")
+async def _build_llm_clients():
+    """Construct the Actor and Critic concurrently instead of serially at import time."""
+    app.state.llm, app.state.critic = await asyncio.gather(
+        asyncio.to_thread(LLMScheduler),
+        asyncio.to_thread(Critic),
+    )
+
+
+def _policy_prompt_block(user_id: str) -> str:
+    """Learned-rules block for the Actor prompt (memoized per version by PolicyStore)."""
+    return PolicyStore(user_id).get_policy_prompt_block()
+
+
+def _plan_dict(input_data: DailyInput, routine_response: RoutineResponse) -> Dict[str, Any]:
+    """Shape a RoutineResponse into the plan record persisted by HistoryManager."""
+    return {
+        "date": input_data.current_date,
+        # One pydantic-core pass over the task list rather than a model_dump per task
+        "scheduled_tasks": routine_response.data.model_dump(include={"scheduled_tasks"})["scheduled_tasks"],
+        "metadata": {
+            "confidence_score": routine_response.data.meta.confidence,
+            "energy_peak_utilized": True,
+        },
+    }
+
+
+def _save_plan(history_mgr: HistoryManager, input_data: DailyInput, routine_response: RoutineResponse) -> None:
+    """Persist the generated plan (completion merged later via /log_completion)."""
+    history_mgr.save_plan(_plan_dict(input_data, routine_response))
+
+
+# Plan writes deferred past the response, per (user_id, date). A client may post
+# /log_completion (or /trigger_reflection) for that day before the write runs;
+# those endpoints wait on these first, so the plan always lands before its
+# completion. Per-process only, like the rest of the in-memory state.
+_pending_plan_writes: Dict[Tuple[str, str], Set[asyncio.Event]] = {}
+
+
+def _defer_plan_write(
+    background_tasks: BackgroundTasks,
+    history_mgr: HistoryManager,
+    input_data: DailyInput,
+    routine_response: RoutineResponse,
+) -> None:
+    """Register the write now, while the request is still in flight, and run it after the response."""
+    key = (input_data.user_id, input_data.current_date)
+    done = asyncio.Event()
+    _pending_plan_writes.setdefault(key, set()).add(done)
+
+    async def _write() -> None:
+        try:
+            await asyncio.to_thread(_save_plan, history_mgr, input_data, routine_response)
+        finally:
+            done.set()
+            pending = _pending_plan_writes.get(key)
+            if pending is not None:
+                pending.discard(done)
+                if not pending:
+                    del _pending_plan_writes[key]
+
+    background_tasks.add_task(_write)
+
+
+async def _wait_for_plan_writes(user_id: str, date: str) -> None:
+    pending = tuple(_pending_plan_writes.get((user_id, date), ()))
+    for done in pending:
+        await done.wait()
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
 
 
 # ── Actor endpoint ───────────────────────────────────────────────────
 
 @app.post("/generate_daily_routine", response_model=RoutineResponse)
-async def generate_daily_routine(input_data: DailyInput):
+async def generate_daily_routine(
+    input_data: DailyInput,
+    request: Request,
+    background_tasks: BackgroundTasks,
+):
     """
     Generate an optimised daily routine.
 
@@ -32,42 +136,102 @@ async def generate_daily_routine(input_data: DailyInput):
       - data.scheduled_tasks     – today's minute-by-minute plan
       - data.warnings            – any conflicts or attendance risks
     """
-    print(f"---- GENERATE DAILY ROUTINE INPUT ----\n{input_data.model_dump_json(indent=2)}\n--------------------------------------")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("generate_daily_routine input: %s", input_data.model_dump_json())
 
-    history_mgr = HistoryManager(input_data.user_id)
-    recent_history = history_mgr.get_recent_history(days=5)
+    llm: LLMScheduler = request.app.state.llm
 
-    # Load learned policy rules and inject into the Actor's prompt
-    policy = PolicyStore(input_data.user_id)
-    policy_block = policy.get_policy_prompt_block()
+    # History and learned policy rules are independent reads; fetch them together
+    history_mgr = HistoryManager(input_data.user_id)
+    (recent_history, prior_history), policy_block = await asyncio.gather(
+        asyncio.to_thread(history_mgr.get_recent_and_prior_history, input_data.current_date, days=5),
+        asyncio.to_thread(_policy_prompt_block, input_data.user_id),
+    )
 
-    routine_response: RoutineResponse = llm.generate_routine(
+    # Exact-match response cache. The key only sees history dated before today:
+    # plans for today are this endpoint's own output, and each retry appends
+    # one more, which would invalidate the entry every time.
+    routine_cache: RoutineCache = app.state.routine_cache
+    cache_key = None
+    if llm.TEMPERATURE <= ROUTINE_CACHE_MAX_TEMPERATURE:
+        cache_key = RoutineCache.make_key(
+            input=input_data.model_dump(),
+            history=prior_history,
+            policy=policy_block,
+            model=llm.model,
+        )
+        cached = routine_cache.get(cache_key)
+        if cached is not None:
+            # Plan was already persisted when this entry was first generated
+            return RoutineResponse.model_validate(cached)
+
+    routine_response: RoutineResponse = await llm.generate_routine_async(
         input_data, recent_history, policy_block=policy_block
     )
 
-    print(f"---- GENERATE DAILY ROUTINE OUTPUT ----\n{routine_response.model_dump_json(indent=2)}\n---------------------------------------")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("generate_daily_routine output: %s", routine_response.model_dump_json())
 
-    # Persist the generated plan (completion merged later via /log_completion)
-    plan_dict = {
-        "date": input_data.current_date,
-        "scheduled_tasks": [t.model_dump() for t in routine_response.data.scheduled_tasks],
-        "metadata": {
-            "confidence_score": routine_response.data.meta.confidence,
-            "energy_peak_utilized": True,
-        },
-    }
-    history_mgr.save_plan(plan_dict)
+    if cache_key is not None:
+        routine_cache.set(cache_key, routine_response.model_dump())
+
+    # Persist after the response is sent; the client never sees the write
+    _defer_plan_write(background_tasks, history_mgr, input_data, routine_response)
 
     return routine_response
 
 
+@app.post("/generate_daily_routine/stream")
+async def stream_daily_routine(input_data: DailyInput, request: Request):
+    """
+    Server-Sent Events variant of /generate_daily_routine.
+
+    Emits `snapshot` events carrying the latest parseable partial plan (bursts
+    of deltas are coalesced, so at most one every ~100ms), then a single `done`
+    event with the final RoutineResponse (or an `error` event).
+    """
+    llm: LLMScheduler = request.app.state.llm
+    history_mgr = HistoryManager(input_data.user_id)
+    recent_history, policy_block = await asyncio.gather(
+        asyncio.to_thread(history_mgr.get_recent_history, days=5),
+        asyncio.to_thread(_policy_prompt_block, input_data.user_id),
+    )
+
+    async def _events():
+        try:
+            async for event, payload in llm.stream_routine_snapshots(
+                input_data, recent_history, policy_block=policy_block
+            ):
+                if event == "snapshot":
+                    yield _sse("snapshot", payload.model_dump_json())
+                    continue
+                await asyncio.to_thread(_save_plan, history_mgr, input_data, payload)
+                yield _sse("done", payload.model_dump_json())
+        except Exception as e:
+            # Headers are already sent, so failures (LLM, network, disk) can
+            # only reach the client as an event
+            logger.exception("stream_daily_routine failed for %s", input_data.user_id)
+            yield _sse("error", json.dumps({"detail": str(e)}))
+
+    return StreamingResponse(_events(), media_type="text/event-stream")
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Hit/miss counters for the /generate_daily_routine response cache."""
+    return app.state.routine_cache.stats()
+
+
 # ── Completion logging ───────────────────────────────────────────────
 
 @app.post("/log_completion")
 async def log_completion(completion: CompletionLog):
     """Accept a structured CompletionLog and merge it into the user's history."""
     history_mgr = HistoryManager(completion.user_id)
-    found = history_mgr.save_completion(completion.date, completion.model_dump())
+    await _wait_for_plan_writes(completion.user_id, completion.date)
+    found = await asyncio.to_thread(
+        history_mgr.save_completion, completion.date, completion.model_dump()
+    )
 
     status = "merged_with_plan" if found else "saved_standalone"
     print(f"✅ Completion logged for {completion.date} by {completion.user_id} ({status})")
@@ -78,13 +242,20 @@ async def log_completion(completion: CompletionLog):
 # ── Critic / Reflection endpoint ─────────────────────────────────────
 
 @app.post("/trigger_reflection", response_model=CriticEvaluation)
-async def trigger_reflection(user_id: str, date: str):
+async def trigger_reflection(
+    user_id: str,
+    date: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+):
     """
     Run the Critic on a specific day's plan + completion.
-    Updates the user's policy store with the proposed rules.
+    Updates the user's policy store with the proposed rules once the
+    evaluation has been sent.
     """
     history_mgr = HistoryManager(user_id)
-    entry = history_mgr.get_entry_for_date(date)
+    await _wait_for_plan_writes(user_id, date)
+    entry = await asyncio.to_thread(history_mgr.get_entry_for_date, date)
 
     if entry is None:
         raise HTTPException(status_code=404, detail=f"No history entry found for {date}")
@@ -96,12 +267,13 @@ async def trigger_reflection(user_id: str, date: str):
     plan = DailyRoutine.model_validate(entry["generated_plan"])
     completion = CompletionLog.model_validate(entry["completion"])
 
-    policy = PolicyStore(user_id)
-    existing_rules = policy.get_all_rules()
+    policy = await asyncio.to_thread(PolicyStore, user_id)
+    existing_rules = await asyncio.to_thread(policy.get_all_rules)
 
-    evaluation = critic.evaluate(plan, completion, existing_rules)
+    critic: Critic = request.app.state.critic
+    evaluation = await critic.evaluate_async(plan, completion, existing_rules)
 
-    policy.update_rules(evaluation.proposed_rules)
+    background_tasks.add_task(policy.update_rules, evaluation.proposed_rules)
 
     print(f"🧠 Reflection complete for {date} by {user_id}: score={evaluation.performance_score}")
     return evaluation
@@ -112,8 +284,8 @@ async def trigger_reflection(user_id: str, date: str):
 @app.get("/view_policy/{user_id}")
 async def view_policy(user_id: str):
     """Return the current learned scheduling policy for a user."""
-    policy = PolicyStore(user_id)
-    return policy.to_dict()
+    policy = await asyncio.to_thread(PolicyStore, user_id)
+    return await asyncio.to_thread(policy.to_dict)
 
 
 
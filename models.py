@@ -3,6 +3,15 @@ from typing import List, Dict, Optional, Any
 from datetime import datetime
 
 
+def utc_timestamp() -> str:
+    """Current UTC time as 'YYYY-MM-DDTHH:MM:SS.000Z' (f-string; avoids strftime's locale path)."""
+    dt = datetime.utcnow()
+    return (
+        f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+        f"T{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}.000Z"
+    )
+
+
 # ── Scheduled Task (internal plan) ──────────────────────────────────
 
 class ScheduledTask(BaseModel):
@@ -81,9 +90,7 @@ class TimetableMeta(BaseModel):
     program: str = "Unknown Program"
     semester: str = "Unknown Semester"
     section: str = "Unknown Section"
-    generated_at: str = Field(
-        default_factory=lambda: datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z")
-    )
+    generated_at: str = Field(default_factory=utc_timestamp)
     timezone: str = "Asia/Kolkata"
     confidence: float = 0.9
 
@@ -1,15 +1,73 @@
-import json
+import bisect
+import os
+import orjson
+import sqlite3
+import threading
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 from rl_models import PolicyRule, UserPolicy
 
+DB_PATH = Path(os.getenv("POLICY_DB_PATH", "policy.db"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    user_id     TEXT NOT NULL,
+    rule_id     TEXT NOT NULL,
+    rule_text   TEXT NOT NULL,
+    confidence  REAL NOT NULL,
+    source_date TEXT NOT NULL,
+    category    TEXT NOT NULL,
+    PRIMARY KEY (user_id, rule_id)
+);
+-- Kept in prompt order (confidence DESC, then rowid) so active rules are a
+-- forward range scan with no sort step
+CREATE INDEX IF NOT EXISTS rules_user_confidence_desc ON rules (user_id, confidence DESC);
+CREATE TABLE IF NOT EXISTS policies (
+    user_id          TEXT PRIMARY KEY,
+    last_updated     TEXT,
+    reflection_count INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_RULE_COLUMNS = "rule_id, rule_text, confidence, source_date, category"
+
+# Confidence bands for the prompt block: [0, 0.4) LOW, [0.4, 0.7) MEDIUM, [0.7, 1] HIGH
+_LABELS = ("LOW", "MEDIUM", "HIGH")
+_CUTS = (0.4, 0.7)
+
+# user_id -> (reflection_count, rendered prompt block); shared by every store instance
+_PROMPT_BLOCK_CACHE: Dict[str, Tuple[int, str]] = {}
+
+def _local_timestamp() -> str:
+    """Local time as 'YYYY-MM-DD HH:MM:SS' without strftime's locale machinery."""
+    dt = datetime.now()
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
+
+
+# sqlite3 connections can't cross threads, and handlers run on a threadpool
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
 
 class PolicyStore:
     """
-    Persistent per-user policy store backed by a JSON file.
-    Stores learned scheduling rules and supports merge/prune operations.
+    Persistent per-user policy store backed by a shared SQLite database (WAL mode).
+    Stores learned scheduling rules and supports merge/prune operations; a rule
+    update touches only the rows it changes. Every method uses the calling
+    thread's connection, so an instance may be used from any thread.
     """
 
     MIN_CONFIDENCE = 0.1
@@ -19,71 +77,130 @@ class PolicyStore:
 
     def __init__(self, user_id: str):
         self.user_id = user_id
-        self.file_path = Path(f"policy_{user_id}.json")
-        self.policy = self._load()
-
-    def _load(self) -> UserPolicy:
-        if self.file_path.exists():
-            with open(self.file_path, "r") as f:
-                data = json.load(f)
-            return UserPolicy.model_validate(data)
-        return UserPolicy(user_id=self.user_id)
-
-    def _save(self) -> None:
-        with open(self.file_path, "w") as f:
-            json.dump(self.policy.model_dump(), f, indent=2, default=str)
+        self._migrate_legacy_file()
+
+    @staticmethod
+    def legacy_path_for(user_id: str) -> Path:
+        return Path(f"policy_{user_id}.json")
+
+    @staticmethod
+    def version(user_id: str) -> int:
+        """reflection_count for the user: bumps on every update, so it keys derived caches."""
+        row = _connect().execute(
+            "SELECT reflection_count FROM policies WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row["reflection_count"] if row else 0
+
+    def _migrate_legacy_file(self) -> None:
+        """
+        Import a pre-SQLite policy_<user>.json once; the file is left in place.
+        The check and the inserts aren't atomic, so two threads may both get
+        here for a new user: OR IGNORE lets the second one back off.
+        """
+        legacy = self.legacy_path_for(self.user_id)
+        if not legacy.exists():
+            return
+        conn = _connect()
+        with conn:
+            known = conn.execute(
+                "SELECT 1 FROM policies WHERE user_id = ?", (self.user_id,)
+            ).fetchone()
+            if known:
+                return
+            policy = UserPolicy.model_validate(orjson.loads(legacy.read_bytes()))
+            conn.executemany(
+                f"INSERT OR IGNORE INTO rules (user_id, {_RULE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (self.user_id, r.rule_id, r.rule_text, r.confidence, r.source_date, r.category)
+                    for r in policy.rules
+                ],
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO policies (user_id, last_updated, reflection_count) VALUES (?, ?, ?)",
+                (self.user_id, policy.last_updated, policy.reflection_count),
+            )
+
+    def _select_rules(self, where: str = "", params: tuple = ()) -> List[PolicyRule]:
+        rows = _connect().execute(
+            f"SELECT {_RULE_COLUMNS} FROM rules WHERE user_id = ? {where}",
+            (self.user_id, *params),
+        )
+        return [PolicyRule(**dict(row)) for row in rows]
 
     def get_all_rules(self) -> List[PolicyRule]:
-        return list(self.policy.rules)
+        return self._select_rules("ORDER BY rowid")
 
     def get_active_rules(self) -> List[PolicyRule]:
-        return sorted(
-            [r for r in self.policy.rules if r.confidence >= self.ACTIVE_THRESHOLD],
-            key=lambda r: r.confidence,
-            reverse=True,
+        return self._select_rules(
+            "AND confidence >= ? ORDER BY confidence DESC, rowid", (self.ACTIVE_THRESHOLD,)
         )
 
     def update_rules(self, proposed_rules: List[PolicyRule]) -> None:
-        existing_map = {r.rule_id: r for r in self.policy.rules}
-
-        for pr in proposed_rules:
-            if pr.rule_id in existing_map:
-                old = existing_map[pr.rule_id]
-                old.rule_text = pr.rule_text
-                old.confidence = min(1.0, old.confidence + self.CONFIDENCE_BOOST)
-                old.source_date = pr.source_date
-            else:
-                existing_map[pr.rule_id] = pr
-
-        self.policy.rules = [
-            r for r in existing_map.values() if r.confidence >= self.MIN_CONFIDENCE
-        ]
-        self.policy.reflection_count += 1
-        self.policy.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self._save()
+        conn = _connect()
+        with conn:
+            # New rules go in as proposed; known ones take the new text and a boost
+            conn.executemany(
+                f"""
+                INSERT INTO rules (user_id, {_RULE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, rule_id) DO UPDATE SET
+                    rule_text   = excluded.rule_text,
+                    confidence  = MIN(1.0, rules.confidence + {self.CONFIDENCE_BOOST}),
+                    source_date = excluded.source_date
+                """,
+                [
+                    (self.user_id, pr.rule_id, pr.rule_text, pr.confidence, pr.source_date, pr.category)
+                    for pr in proposed_rules
+                ],
+            )
+            conn.execute(
+                "DELETE FROM rules WHERE user_id = ? AND confidence < ?",
+                (self.user_id, self.MIN_CONFIDENCE),
+            )
+            conn.execute(
+                """
+                INSERT INTO policies (user_id, last_updated, reflection_count) VALUES (?, ?, 1)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    last_updated     = excluded.last_updated,
+                    reflection_count = policies.reflection_count + 1
+                """,
+                (self.user_id, _local_timestamp()),
+            )
+        _PROMPT_BLOCK_CACHE.pop(self.user_id, None)
 
     def get_policy_prompt_block(self) -> str:
+        """
+        Rendered active rules, memoized per policy version so repeat requests
+        skip the query/format and send byte-identical text (keeps the LLM-side
+        prompt prefix cacheable).
+        """
+        version = self.version(self.user_id)
+        cached = _PROMPT_BLOCK_CACHE.get(self.user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
         active = self.get_active_rules()
-        if not active:
-            return ""
-
-        def _label(conf: float) -> str:
-            if conf >= 0.7:
-                return "HIGH"
-            if conf >= 0.4:
-                return "MEDIUM"
-            return "LOW"
-
-        lines = [
-            f"- [{_label(r.confidence)} confidence] {r.rule_text}"
-            for r in active
-        ]
-        return (
-            "\n## Learned Scheduling Rules (from past self-reflections)\n"
-            + "\n".join(lines)
-            + "\n\nApply these rules when generating today's schedule. "
-            "If a rule conflicts with explicit user input, user input wins.\n"
-        )
+        block = ""
+        if active:
+            block = (
+                "\n## Learned Scheduling Rules (from past self-reflections)\n"
+                + "\n".join(
+                    f"- [{_LABELS[bisect.bisect_right(_CUTS, r.confidence)]} confidence] {r.rule_text}"
+                    for r in active
+                )
+                + "\n\nApply these rules when generating today's schedule. "
+                "If a rule conflicts with explicit user input, user input wins.\n"
+            )
+        _PROMPT_BLOCK_CACHE[self.user_id] = (version, block)
+        return block
 
     def to_dict(self) -> dict:
-        return self.policy.model_dump()
\ No newline at end of file
+        row: Optional[sqlite3.Row] = _connect().execute(
+            "SELECT last_updated, reflection_count FROM policies WHERE user_id = ?", (self.user_id,)
+        ).fetchone()
+        policy = UserPolicy(
+            user_id=self.user_id,
+            rules=self.get_all_rules(),
+            last_updated=row["last_updated"] if row else None,
+            reflection_count=row["reflection_count"] if row else 0,
+        )
+        return policy.model_dump()
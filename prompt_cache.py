@@ -0,0 +1,76 @@
+import hashlib
+import time
+from typing import Dict, Optional, Tuple
+
+from google import genai
+from google.genai import types
+
+
+class SystemPromptCache:
+    """
+    Maps system prompts to Gemini explicit-cache (CachedContent) handles so an
+    identical prompt prefix is uploaded once and billed at the cached rate.
+
+    Handles are keyed by sha256(system_prompt) and refreshed shortly before their
+    TTL runs out. If the API refuses to cache a prompt (e.g. it is below the
+    model's minimum cacheable size) the refusal is remembered for one TTL and
+    callers fall back to sending `system_instruction` inline.
+    """
+
+    TTL_SECONDS = 3600
+    REFRESH_MARGIN_SECONDS = 60
+
+    def __init__(self, client: genai.Client, model: str):
+        self.client = client
+        self.model = model
+        self._cache_handles: Dict[str, Tuple[Optional[str], float]] = {}
+
+    def get(self, system_prompt: str) -> Optional[str]:
+        """Return the CachedContent name for this prompt, creating it on first use."""
+        key, hit, name = self._lookup(system_prompt)
+        if hit:
+            return name
+        try:
+            name = self.client.caches.create(
+                model=self.model, config=self._create_config(system_prompt)
+            ).name
+        except Exception as e:
+            self._warn_refused(e)
+            name = None
+        return self._store(key, name)
+
+    async def get_async(self, system_prompt: str) -> Optional[str]:
+        """Async twin of get(), using the client's aio surface."""
+        key, hit, name = self._lookup(system_prompt)
+        if hit:
+            return name
+        try:
+            cached = await self.client.aio.caches.create(
+                model=self.model, config=self._create_config(system_prompt)
+            )
+            name = cached.name
+        except Exception as e:
+            self._warn_refused(e)
+            name = None
+        return self._store(key, name)
+
+    def _lookup(self, system_prompt: str) -> Tuple[str, bool, Optional[str]]:
+        key = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        entry = self._cache_handles.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return key, True, entry[0]
+        return key, False, None
+
+    def _create_config(self, system_prompt: str) -> types.CreateCachedContentConfig:
+        return types.CreateCachedContentConfig(
+            system_instruction=system_prompt,
+            ttl=f"{self.TTL_SECONDS}s",
+        )
+
+    def _warn_refused(self, error: Exception) -> None:
+        print(f"⚠️  Prompt cache unavailable for {self.model}, sending system prompt inline: {error}")
+
+    def _store(self, key: str, name: Optional[str]) -> Optional[str]:
+        expires = time.monotonic() + self.TTL_SECONDS - self.REFRESH_MARGIN_SECONDS
+        self._cache_handles[key] = (name, expires)
+        return name
@@ -20,6 +20,11 @@ No LLM calls — deterministic logic only.
 
 from __future__ import annotations
 
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import itemgetter
 from typing import List, Tuple, Dict
 
 try:
@@ -28,20 +33,34 @@ except ImportError:
     pass  # ScheduledTask injected at runtime (tests / standalone use)
 
 
+@dataclass(slots=True)
+class _Task:
+    """Unvalidated ScheduledTask stand-in for the carving loop; converted once on return."""
+    time_slot: str
+    task_name: str
+    is_attendance_safe: bool
+    estimated_minutes: int
+
+
 # ── time helpers ──────────────────────────────────────────────────────────────
+# Slot strings and minute values recur heavily across requests, and every
+# helper here is pure with immutable results, so each is memoized.
 
+@lru_cache(maxsize=8192)
 def _to_minutes(t: str) -> int:
     """'HH:MM' -> total minutes since midnight."""
     h, m = t.strip().split(":")
     return int(h) * 60 + int(m)
 
 
+@lru_cache(maxsize=8192)
 def _to_hhmm(minutes: int) -> str:
     """Total minutes -> 'HH:MM'  (supports post-midnight values >= 1440)."""
     h, m = divmod(minutes, 60)
     return f"{h:02d}:{m:02d}"
 
 
+@lru_cache(maxsize=8192)
 def _parse_slot(time_slot: str) -> Tuple[int, int]:
     """'HH:MM-HH:MM' -> (start_minutes, end_minutes).
     Handles overnight slots e.g. '22:00-02:00' -> (1320, 1560)."""
@@ -57,85 +76,84 @@ def _make_slot(start: int, end: int) -> str:
     return f"{_to_hhmm(start)}-{_to_hhmm(end)}"
 
 
-def _overlaps(s1: int, e1: int, s2: int, e2: int) -> bool:
-    return s1 < e2 and s2 < e1
-
-
 # ── interval arithmetic ───────────────────────────────────────────────────────
 
 def _subtract_intervals(
     start: int,
     end: int,
-    blocked: List[Tuple[int, int]],
+    blocked_starts: array,
+    blocked_ends: array,
 ) -> List[Tuple[int, int]]:
-    """Return free sub-windows inside [start, end] after removing all blocked intervals."""
-    free: List[Tuple[int, int]] = [(start, end)]
-    for b_start, b_end in blocked:
-        new_free: List[Tuple[int, int]] = []
-        for f_start, f_end in free:
-            if b_end <= f_start or b_start >= f_end:      # no overlap
-                new_free.append((f_start, f_end))
-            else:
-                if f_start < b_start:                      # left portion
-                    new_free.append((f_start, b_start))
-                if b_end < f_end:                          # right portion
-                    new_free.append((b_end, f_end))
-        free = new_free
+    """
+    Return free sub-windows inside [start, end] after removing all blocked intervals.
+    Blocks are given as parallel start/end arrays, sorted and non-overlapping, so
+    the first block that can reach `start` is found by bisecting the ends and a
+    single forward walk emits every gap.
+    """
+    free: List[Tuple[int, int]] = []
+    i = bisect_right(blocked_ends, start)
+    cursor = start
+    while i < len(blocked_starts) and blocked_starts[i] < end:
+        if cursor < blocked_starts[i]:
+            free.append((cursor, blocked_starts[i]))
+        cursor = max(cursor, blocked_ends[i])
+        i += 1
+    if cursor < end:
+        free.append((cursor, end))
     return free
 
 
 # ── residual-overlap safety pass ─────────────────────────────────────────────
 
-def _resolve_residual_overlaps(tasks: List[ScheduledTask]) -> List[ScheduledTask]:
+def _resolve_residual_overlaps(
+    tasks: List[Tuple[int, int, _Task]],
+) -> List[_Task]:
     """
-    Final safety sweep over a sorted task list.
+    Final safety sweep over a list of (start, end, task) sorted by start.
     If two consecutive tasks still overlap:
       - CLASS always wins.
       - Personal task is pushed / trimmed.
     """
     if not tasks:
-        return tasks
+        return []
 
-    result: List[ScheduledTask] = [tasks[0]]
+    result: List[Tuple[int, int, _Task]] = [tasks[0]]
 
-    for task in tasks[1:]:
-        prev     = result[-1]
-        prev_end = _parse_slot(prev.time_slot)[1]
-        t_start, t_end = _parse_slot(task.time_slot)
+    for t_start, t_end, task in tasks[1:]:
+        prev_start, prev_end, prev = result[-1]
 
         if t_start >= prev_end:
-            result.append(task)
+            result.append((t_start, t_end, task))
             continue
 
         # ── collision ──
         if task.task_name.startswith("[CLASS]"):
             # Incoming CLASS wins -- trim the previous personal task if possible
             if not prev.task_name.startswith("[CLASS]"):
-                prev_start = _parse_slot(prev.time_slot)[0]
                 if prev_start < t_start:
-                    result[-1] = ScheduledTask(
+                    result[-1] = (prev_start, t_start, _Task(
                         time_slot=_make_slot(prev_start, t_start),
                         task_name=prev.task_name,
                         is_attendance_safe=prev.is_attendance_safe,
                         estimated_minutes=t_start - prev_start,
-                    )
+                    ))
                 else:
                     result.pop()   # no space left -- drop the personal task entirely
             # CLASS-vs-CLASS overlap should not occur after step 2; skip silently
-            result.append(task)
+            result.append((t_start, t_end, task))
         else:
             # Personal task loses -- push start to prev_end
             new_duration = t_end - prev_end
             if new_duration > 0:
-                result.append(ScheduledTask(
+                result.append((prev_end, t_end, _Task(
                     time_slot=_make_slot(prev_end, t_end),
                     task_name=task.task_name,
                     is_attendance_safe=task.is_attendance_safe,
                     estimated_minutes=new_duration,
-                ))
+                )))
             # else zero/negative duration -- drop silently
 
-    return result
+    return [task for _, _, task in result]
 
 
 # ── main public function ──────────────────────────────────────────────────────
@@ -199,29 +217,36 @@ def build_collision_free_schedule(
     # The full weekly timetable can have multiple subjects at the same time
     # (they belong to different weekdays).  We keep the first subject seen for
     # each distinct interval; later subjects that overlap are skipped.
-    class_tasks: List[ScheduledTask] = []
+    # (start, end, task) throughout, so slots are never re-parsed from strings
+    class_tasks: List[Tuple[int, int, _Task]] = []
     accepted_intervals: List[Tuple[int, int]] = []
+    # Candidates arrive in start order and accepted windows never overlap, so
+    # the last accepted window has the latest end and is the only one to check
+    last_accepted_end = 0
 
     for c in candidates:
         s, e = c["start_m"], c["end_m"]
-        if any(_overlaps(s, e, os, oe) for os, oe in accepted_intervals):
+        if s < last_accepted_end:
             continue   # another class already owns this window
         accepted_intervals.append((s, e))
-        class_tasks.append(ScheduledTask(
+        last_accepted_end = e
+        class_tasks.append((s, e, _Task(
             time_slot=_make_slot(s, e),
             task_name=f"[CLASS] {c['subject']}",
             is_attendance_safe=not c["critical"],
             estimated_minutes=e - s,
-        ))
+        )))
 
-    class_tasks.sort(key=lambda t: _parse_slot(t.time_slot)[0])
-    fixed_intervals: List[Tuple[int, int]] = [_parse_slot(ct.time_slot) for ct in class_tasks]
+    # Candidates were visited in start order, so these are already sorted, and
+    # step 2 keeps them pairwise disjoint, as _subtract_intervals requires
+    fixed_starts = array("i", (s for s, _ in accepted_intervals))
+    fixed_ends   = array("i", (e for _, e in accepted_intervals))
 
     # ── Step 3: strip any [CLASS] tasks the LLM hallucinated ─────────────────
     personal_tasks = [t for t in llm_tasks if not t.task_name.startswith("[CLASS]")]
 
     # ── Step 4: carve personal tasks into the free windows ───────────────────
-    fitted_personal: List[ScheduledTask] = []
+    fitted_personal: List[Tuple[int, int, _Task]] = []
 
     for task in personal_tasks:
         try:
@@ -229,21 +254,29 @@ def build_collision_free_schedule(
         except Exception:
             continue  # skip malformed slots
 
-        free_windows = _subtract_intervals(t_start, t_end, fixed_intervals)
+        free_windows = _subtract_intervals(t_start, t_end, fixed_starts, fixed_ends)
         for w_start, w_end in free_windows:
             duration = w_end - w_start
             if duration <= 0:
                 continue
-            fitted_personal.append(ScheduledTask(
+            fitted_personal.append((w_start, w_end, _Task(
                 time_slot=_make_slot(w_start, w_end),
                 task_name=task.task_name,
                 is_attendance_safe=task.is_attendance_safe,
                 estimated_minutes=duration,
-            ))
+            )))
 
     # ── Step 5: merge, sort, final safety pass ────────────────────────────────
     merged = class_tasks + fitted_personal
-    merged.sort(key=lambda t: _parse_slot(t.time_slot)[0])
-    merged = _resolve_residual_overlaps(merged)
-
-    return merged
\ No newline at end of file
+    merged.sort(key=itemgetter(0))
+
+    # Every field was produced here from validated inputs, so skip re-validation
+    return [
+        ScheduledTask.model_construct(
+            time_slot=t.time_slot,
+            task_name=t.task_name,
+            is_attendance_safe=t.is_attendance_safe,
+            estimated_minutes=t.estimated_minutes,
+        )
+        for t in _resolve_residual_overlaps(merged)
+    ]
\ No newline at end of file
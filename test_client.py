@@ -1,9 +1,10 @@
-import json
+import orjson
 from google import genai
 from models import DailyRoutine
 import os
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY")) # Assumes GEMINI_API_KEY environment variable is set
+# Derived once; the SDK would otherwise re-introspect DailyRoutine on every call
+_ROUTINE_SCHEMA = DailyRoutine.model_json_schema()
 
 example_input = {
     "user_id": "upadhyay_nisarg",
@@ -31,15 +32,26 @@ example_input = {
     "today_deadlines": [{"title": "Physics assignment", "due": "23:59"}]
 }
 
-print("Generating routine via Gemini API...")
-response = client.models.generate_content(
-    model='gemini-2.0-flash',
-    contents=[str(example_input)],
-    config={
-        'response_mime_type': 'application/json',
-        'response_schema': DailyRoutine,
-    }
-)
-
-print("\n--- Generated Routine ---")
-print(json.dumps(response.parsed.model_dump(), indent=2))
\ No newline at end of file
+
+def main():
+    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY")) # Assumes GEMINI_API_KEY environment variable is set
+
+    print("Generating routine via Gemini API...")
+    response = client.models.generate_content(
+        model='gemini-2.0-flash',
+        # Real JSON (not the dict's repr), sort-keyed so the prompt bytes are deterministic
+        contents=[orjson.dumps(example_input, option=orjson.OPT_SORT_KEYS).decode()],
+        config={
+            'response_mime_type': 'application/json',
+            'response_json_schema': _ROUTINE_SCHEMA,
+        }
+    )
+    # A raw JSON schema leaves `parsed` as plain data, so validate the text once here
+    routine = DailyRoutine.model_validate_json(response.text)
+
+    print("\n--- Generated Routine ---")
+    print(routine.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
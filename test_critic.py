@@ -1,32 +1,159 @@
 import os
-import json
+import sys
+import asyncio
+import hashlib
+import sqlite3
+import time
+import orjson
+from typing import Any, Dict, List, Optional, Tuple, Union, get_args, get_origin
 from dotenv import load_dotenv
 load_dotenv()
 
 from critic import Critic
+from history_manager import HistoryManager
 from models import DailyRoutine
-from rl_models import CompletionLog
-
-with open("history_upadhyay_nisarg.jsonl", "r") as f:
-    lines = f.readlines()
-
-critic = Critic(model="gemini-2.5-flash")
-
-for i, line in enumerate(lines):
-    if not line.strip():
-        continue
-    entry = json.loads(line)
-    if entry.get("completion") is None:
-        continue
-        
-    plan = DailyRoutine.model_validate(entry["generated_plan"])
-    completion = CompletionLog.model_validate(entry["completion"])
-
-    try:
-        print(f"Evaluating entry {i}...")
-        eval_obj = critic.evaluate(plan, completion, [])
-        print(f"Success for entry {i}")
-    except Exception as e:
-        print(f"Error on entry {i}")
-        import traceback
-        traceback.print_exc()
+from rl_models import CompletionLog, CriticEvaluation
+from pydantic import BaseModel
+
+# Concurrent Critic calls in flight; keeps a burst inside the API quota
+MAX_CONCURRENCY = 20
+
+HISTORY_PATH = "history_upadhyay_nisarg.jsonl"
+
+# stdout is block-buffered and flushed every FLUSH_EVERY results instead of per line
+FLUSH_EVERY = 64
+
+# Evaluations of (plan, completion) pairs already seen, kept across runs. The
+# key also covers the model, system prompt and existing rules, so changing any
+# of them re-evaluates; entries expire after CRITIC_CACHE_TTL seconds.
+RESULT_CACHE_PATH = os.getenv("CRITIC_CACHE_PATH", ".critic_cache.sqlite")
+RESULT_CACHE_TTL = int(os.getenv("CRITIC_CACHE_TTL", str(7 * 86400)))
+
+# The script reflects with no prior policy
+EXISTING_RULES: List = []
+
+def _fast_construct(cls: type, data: dict) -> BaseModel:
+    """
+    model_construct all the way down: nested models and lists of models are
+    built unvalidated too. Only for trusted, self-produced data (the history
+    was validated when it was written).
+    """
+    return cls.model_construct(**{
+        name: _construct_value(field.annotation, data[name])
+        for name, field in cls.model_fields.items()
+        if name in data
+    })
+
+
+def _construct_value(annotation: Any, value: Any) -> Any:
+    if value is None:
+        return None
+    origin = get_origin(annotation)
+    if origin in (list, List):
+        (item,) = get_args(annotation) or (Any,)
+        return [_construct_value(item, v) for v in value]
+    if origin is Union:
+        inner = [a for a in get_args(annotation) if a is not type(None)]
+        return _construct_value(inner[0], value) if len(inner) == 1 else value
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel) and isinstance(value, dict):
+        return _fast_construct(annotation, value)
+    return value
+
+
+def _pair_key(critic: Critic, entry: dict) -> bytes:
+    return hashlib.blake2b(
+        orjson.dumps(
+            (critic.model, critic.SYSTEM_PROMPT, EXISTING_RULES, entry["generated_plan"], entry["completion"]),
+            option=orjson.OPT_SORT_KEYS,
+        )
+    ).digest()
+
+
+async def evaluate_entry(
+    critic: Critic,
+    key: bytes,
+    indices: List[int],
+    plan: DailyRoutine,
+    completion: CompletionLog,
+    semaphore: asyncio.Semaphore,
+) -> Tuple[bytes, List[int], Optional[CriticEvaluation], bool]:
+    async with semaphore:
+        try:
+            print(f"Evaluating entry {indices[0]}...")
+            evaluation, repaired = await critic.evaluate_checked_async(plan, completion, EXISTING_RULES)
+            return key, indices, evaluation, repaired
+        except Exception:
+            print(f"Error on entry {indices[0]}")
+            import traceback
+            traceback.print_exc(file=sys.stdout)   # keep it in order with the buffered lines
+            return key, indices, None, False
+
+
+async def run_all(path: str) -> None:
+    critic = Critic(model="gemini-2.5-flash")
+
+    # Stream the file line by line; completions may arrive as separate
+    # `_patch` lines, so fold them onto their plans
+    with open(path, "rb", buffering=1 << 20) as f:
+        entries = HistoryManager._merge([orjson.loads(line) for line in f if line.strip()])
+
+    # Identical (plan, completion) pairs are evaluated once
+    groups: Dict[bytes, List[int]] = {}
+    for i, e in enumerate(entries):
+        if e.get("completion") is not None and e.get("generated_plan") is not None:
+            groups.setdefault(_pair_key(critic, e), []).append(i)
+
+    db = sqlite3.connect(RESULT_CACHE_PATH)
+    db.execute("CREATE TABLE IF NOT EXISTS evaluations (key BLOB PRIMARY KEY, evaluation BLOB, ts REAL)")
+    with db:
+        db.execute("DELETE FROM evaluations WHERE ts < ?", (time.time() - RESULT_CACHE_TTL,))
+    cached = {
+        key: evaluation
+        for key, evaluation in db.execute("SELECT key, evaluation FROM evaluations")
+        if key in groups
+    }
+    for key, evaluation in cached.items():
+        print(f"Cached result for entries {groups[key]}: score={orjson.loads(evaluation)['performance_score']}")
+
+    jobs = [
+        (key, indices,
+         _fast_construct(DailyRoutine, entries[indices[0]]["generated_plan"]),
+         _fast_construct(CompletionLog, entries[indices[0]]["completion"]))
+        for key, indices in groups.items()
+        if key not in cached
+    ]
+
+    # Create the static-prefix cache once, before the burst, so concurrent
+    # first calls don't each try to create it
+    await critic.warm_prompt_cache_async()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    pending = [evaluate_entry(critic, *job, semaphore) for job in jobs]
+
+    # Report in completion order so progress shows while slow calls are in flight
+    for done, finished in enumerate(asyncio.as_completed(pending), 1):
+        key, indices, evaluation, repaired = await finished
+        if evaluation is None:
+            print(f"[{done}/{len(jobs)}] Failed for entries {indices}")
+        elif repaired:
+            # Possibly truncated / last-resort output: report it, but don't keep it
+            print(f"[{done}/{len(jobs)}] Repaired (not cached) for entries {indices}: score={evaluation.performance_score}")
+        else:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO evaluations (key, evaluation, ts) VALUES (?, ?, ?)",
+                    (key, evaluation.model_dump_json().encode(), time.time()),
+                )
+            print(f"[{done}/{len(jobs)}] Success for entries {indices}: score={evaluation.performance_score}")
+        if done % FLUSH_EVERY == 0:
+            sys.stdout.flush()
+    db.close()
+    sys.stdout.flush()
+
+
+def main():
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    asyncio.run(run_all(HISTORY_PATH))
+
+
+if __name__ == "__main__":
+    main()
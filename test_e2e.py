@@ -1,8 +1,44 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import sys
+import time
 import httpx
-import json
+import orjson
+from typing import Optional
 
 BASE_URL = "http://localhost:8002"
 
+# Opt-in local cache of the step 1 /generate_daily_routine response so local
+# reruns skip the LLM (--cache or E2E_CACHE=1). A hit never reaches the server,
+# so only use it against a server that already holds that plan from an earlier
+# run. The full-loop step always goes to the server: it checks learned rules.
+RESPONSE_CACHE_PATH = os.getenv("E2E_CACHE_PATH", ".e2e_cache.sqlite")
+RESPONSE_CACHE_TTL = int(os.getenv("E2E_CACHE_TTL", "86400"))
+USE_CACHE = "--cache" in sys.argv or os.getenv("E2E_CACHE") == "1"
+
+# Local-dev shortcut: trivial inputs get a canned routine without any HTTP call.
+# Leave unset for correctness runs (CI), which must hit the server.
+E2E_FAST = os.getenv("DAYPLANNER_E2E_FAST") == "1"
+
+# Settings for the one pooled client shared by every step
+CLIENT_TIMEOUT = httpx.Timeout(120.0, connect=5.0)
+CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=20)
+
+# Step 3 saves the proposed rules in a background task after responding; the
+# fan-out waits (up to this long) for reflection_count to advance first
+POLICY_WAIT_TIMEOUT = 10.0
+POLICY_POLL_INTERVAL = 0.1
+
+# HTTP/2 (httpx[http2]) multiplexes concurrent steps when the server sits behind
+# a TLS terminator; plain uvicorn stays HTTP/1.1, which is why the pool is kept
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
 # ── New extended input ────────────────────────────────────────────────
 example_input = {
     "user_id": "upadhyay_nisarg",
@@ -33,6 +69,45 @@ example_input = {
     "archetype": "grinder"
 }
 
+# ── Response cache ─────────────────────────────────────────────────────
+
+_cache_db = None
+
+
+def _cache() -> sqlite3.Connection:
+    global _cache_db
+    if _cache_db is None:
+        _cache_db = sqlite3.connect(RESPONSE_CACHE_PATH)
+        _cache_db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, body BLOB, ts REAL)")
+    return _cache_db
+
+
+async def cached_post(client: httpx.AsyncClient, path: str, body: bytes) -> httpx.Response:
+    """
+    POST a pre-serialized JSON `body` to `path`, serving a fresh identical earlier
+    200 response from the local cache when USE_CACHE is set. A hit never reaches
+    the server, so it also skips the server-side plan write; earlier runs'
+    history is relied on instead.
+    """
+    if not USE_CACHE:
+        return await client.post(path, content=body, headers=JSON_HEADERS)
+
+    key = hashlib.sha256(path.encode() + b"\n" + body).hexdigest()
+    row = _cache().execute("SELECT body, ts FROM cache WHERE key = ?", (key,)).fetchone()
+    if row is not None and time.time() - row[1] < RESPONSE_CACHE_TTL:
+        print("  (cached response)")
+        return httpx.Response(200, content=row[0], headers=JSON_HEADERS)
+
+    response = await client.post(path, content=body, headers=JSON_HEADERS)
+    if response.status_code == 200:
+        with _cache():
+            _cache().execute(
+                "INSERT OR REPLACE INTO cache (key, body, ts) VALUES (?, ?, ?)",
+                (key, response.content, time.time()),
+            )
+    return response
+
+
 # ── Completion data ────────────────────────────────────────────────────
 example_completion = {
     "user_id": "upadhyay_nisarg",
@@ -48,17 +123,67 @@ example_completion = {
     "reflection": "Skipped ML because I was tired after back-to-back lectures. DSA ran long again."
 }
 
+# ── Request bodies, encoded once (sort-keyed, so cache keys are stable) ──
+JSON_HEADERS = {"content-type": "application/json"}
+EXAMPLE_INPUT_BYTES = orjson.dumps(example_input, option=orjson.OPT_SORT_KEYS)
+EXAMPLE_COMPLETION_BYTES = orjson.dumps(example_completion, option=orjson.OPT_SORT_KEYS)
+next_day_input = {**example_input, "current_date": "2026-03-01", "current_day": "Sunday"}
+NEXT_DAY_INPUT_BYTES = orjson.dumps(next_day_input, option=orjson.OPT_SORT_KEYS)
+
+
+def _minutes(hhmm: str) -> int:
+    h, m = hhmm.split(":")
+    return int(h) * 60 + int(m)
+
 
-def test_generate_routine():
+def maybe_direct(payload: dict) -> Optional[dict]:
+    """
+    With DAYPLANNER_E2E_FAST=1, a canned RoutineResponse (today's classes only)
+    for inputs with no deadlines and no misc commitments; None otherwise.
+    """
+    if not E2E_FAST or (payload.get("today_deadlines") or payload.get("misc_commitments")):
+        return None
+    return {
+        "success": True,
+        "data": {
+            "meta": {"confidence": 0.0},
+            "suggested_timetable": [],
+            "scheduled_tasks": [
+                {
+                    "time_slot": f"{slot['start_time']}-{slot['end_time']}",
+                    "task_name": f"[CLASS] {slot['subject']}",
+                    "is_attendance_safe": not slot.get("is_attendance_critical", False),
+                    "estimated_minutes": _minutes(slot["end_time"]) - _minutes(slot["start_time"]),
+                }
+                for slot in payload["timetable"]
+            ],
+            "warnings": ["Direct stub (DAYPLANNER_E2E_FAST=1); server not called"],
+        },
+        "message": "Direct stub",
+    }
+
+
+async def generate(client: httpx.AsyncClient, payload: dict, body: bytes, cacheable: bool = True) -> httpx.Response:
+    """POST /generate_daily_routine, unless maybe_direct() answers locally."""
+    stub = maybe_direct(payload)
+    if stub is not None:
+        print("  (direct stub)")
+        return httpx.Response(200, content=orjson.dumps(stub), headers=JSON_HEADERS)
+    if not cacheable:
+        return await client.post("/generate_daily_routine", content=body, headers=JSON_HEADERS)
+    return await cached_post(client, "/generate_daily_routine", body)
+
+
+async def test_generate_routine(client: httpx.AsyncClient):
     """Step 1: Generate a daily routine (Actor) — new envelope expected."""
     print(f"🎬 Testing POST {BASE_URL}/generate_daily_routine...")
     try:
-        with httpx.Client(timeout=120) as client:
-            response = client.post(f"{BASE_URL}/generate_daily_routine", json=example_input)
+        response = await generate(client, example_input, EXAMPLE_INPUT_BYTES)
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             print("✅ /generate_daily_routine successful!")
+            print(f"  http_version     : {response.http_version}")
             print(f"  success          : {data.get('success')}")
             print(f"  message          : {data.get('message')}")
             meta = data.get("data", {}).get("meta", {})
@@ -84,16 +209,17 @@ def test_generate_routine():
         return False
 
 
-def test_log_completion():
+async def test_log_completion(client: httpx.AsyncClient):
     """Step 2: Log task completion data."""
     print(f"\n📝 Testing POST {BASE_URL}/log_completion...")
     try:
-        with httpx.Client(timeout=30) as client:
-            response = client.post(f"{BASE_URL}/log_completion", json=example_completion)
+        response = await client.post(
+            "/log_completion", content=EXAMPLE_COMPLETION_BYTES, headers=JSON_HEADERS, timeout=30
+        )
 
         if response.status_code == 200:
             print("✅ /log_completion successful!")
-            print(f"  Response: {response.json()}")
+            print(f"  Response: {orjson.loads(response.content)}")
             return True
         else:
             print(f"❌ Log completion failed with status {response.status_code}")
@@ -104,18 +230,17 @@ def test_log_completion():
         return False
 
 
-def test_trigger_reflection():
+async def test_trigger_reflection(client: httpx.AsyncClient):
     """Step 3: Trigger the Critic to reflect on the day."""
     print(f"\n🧠 Testing POST {BASE_URL}/trigger_reflection...")
     try:
-        with httpx.Client(timeout=120) as client:
-            response = client.post(
-                f"{BASE_URL}/trigger_reflection",
-                params={"user_id": "upadhyay_nisarg", "date": "2026-02-28"},
-            )
+        response = await client.post(
+            "/trigger_reflection",
+            params={"user_id": "upadhyay_nisarg", "date": "2026-02-28"},
+        )
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             print("✅ /trigger_reflection successful!")
             print(f"  Performance Score: {data.get('performance_score')}")
             for obs in data.get("observations", []):
@@ -132,15 +257,14 @@ def test_trigger_reflection():
         return False
 
 
-def test_view_policy():
+async def test_view_policy(client: httpx.AsyncClient):
     """Step 4: Inspect the learned policy."""
     print(f"\n📜 Testing GET {BASE_URL}/view_policy/upadhyay_nisarg...")
     try:
-        with httpx.Client(timeout=30) as client:
-            response = client.get(f"{BASE_URL}/view_policy/upadhyay_nisarg")
+        response = await client.get("/view_policy/upadhyay_nisarg", timeout=30)
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             print("✅ /view_policy successful!")
             print(f"  User      : {data.get('user_id')}")
             print(f"  Rules     : {len(data.get('rules', []))}")
@@ -157,20 +281,15 @@ def test_view_policy():
         return False
 
 
-def test_full_loop():
+async def test_full_loop(client: httpx.AsyncClient):
     """Step 5: Generate a second routine — should use the learned policy."""
     print(f"\n🔄 Testing FULL LOOP: generating next-day routine WITH learned policy...")
     try:
-        next_day_input = {
-            **example_input,
-            "current_date": "2026-03-01",
-            "current_day": "Sunday",
-        }
-        with httpx.Client(timeout=120) as client:
-            response = client.post(f"{BASE_URL}/generate_daily_routine", json=next_day_input)
+        # Never cached: the point is a fresh plan built with step 3's rules
+        response = await generate(client, next_day_input, NEXT_DAY_INPUT_BYTES, cacheable=False)
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             print("✅ Second /generate_daily_routine (with policy) successful!")
             print(f"  success: {data.get('success')}")
             print(f"  date   : {data.get('data', {}).get('meta', {}).get('generated_at')}")
@@ -185,27 +304,76 @@ def test_full_loop():
         return False
 
 
-if __name__ == "__main__":
+async def reflection_count(client: httpx.AsyncClient) -> int:
+    response = await client.get("/view_policy/upadhyay_nisarg", timeout=30)
+    response.raise_for_status()
+    return orjson.loads(response.content).get("reflection_count", 0)
+
+
+async def wait_for_policy_update(client: httpx.AsyncClient, before: int) -> bool:
+    """Poll /view_policy until the reflection from step 3 has been persisted."""
+    deadline = time.monotonic() + POLICY_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        if await reflection_count(client) > before:
+            return True
+        await asyncio.sleep(POLICY_POLL_INTERVAL)
+    return False
+
+
+async def main():
     print("=" * 60)
     print("ChronoForge — Actor-Critic RL Loop E2E Tests")
     print("=" * 60)
 
-    steps = [
+    # Each of these depends on the previous step's server-side state
+    chain = [
         ("1. Generate routine (Actor)", test_generate_routine),
         ("2. Log completion",           test_log_completion),
         ("3. Trigger reflection (Critic)", test_trigger_reflection),
+    ]
+    # Both only read what step 3 produced, so they run concurrently once its
+    # background rule update has landed
+    fan_out = [
         ("4. View learned policy",      test_view_policy),
         ("5. Generate routine with policy (Full Loop)", test_full_loop),
     ]
 
-    for name, test_fn in steps:
-        print(f"\n{'─' * 60}")
-        print(f"STEP: {name}")
-        print(f"{'─' * 60}")
-        if not test_fn():
-            print(f"\n⛔ Stopping — step '{name}' failed.")
-            break
+    async with httpx.AsyncClient(
+        base_url=BASE_URL, timeout=CLIENT_TIMEOUT, limits=CLIENT_LIMITS, http2=HTTP2
+    ) as client:
+        try:
+            reflections_before = await reflection_count(client)
+        except httpx.HTTPError as e:
+            print(f"❌ Could not read the current policy from {BASE_URL}: {e}")
+            return
+
+        ok = True
+        for name, test_fn in chain:
+            print(f"\n{'─' * 60}")
+            print(f"STEP: {name}")
+            print(f"{'─' * 60}")
+            if not await test_fn(client):
+                print(f"\n⛔ Stopping — step '{name}' failed.")
+                ok = False
+                break
+
+        if ok and not await wait_for_policy_update(client, reflections_before):
+            print(f"\n⛔ Stopping — policy update not visible after {POLICY_WAIT_TIMEOUT:.0f}s.")
+            ok = False
+
+        if ok:
+            print(f"\n{'─' * 60}")
+            print(f"STEPS: {' | '.join(name for name, _ in fan_out)} (concurrent)")
+            print(f"{'─' * 60}")
+            results = await asyncio.gather(*(test_fn(client) for _, test_fn in fan_out))
+            for (name, _), passed in zip(fan_out, results):
+                if not passed:
+                    print(f"\n⛔ Step '{name}' failed.")
 
     print(f"\n{'=' * 60}")
     print("Tests finished.")
-    print(f"{'=' * 60}")
\ No newline at end of file
+    print(f"{'=' * 60}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import orjson
+
+from critic import _repair_truncated_json
+
+
+SAMPLE = (
+    '{"performance_score": 72, '
+    '"observations": ["Lecture ran 10:00-11:15: \\"CN\\" overran", "Skipped ML"], '
+    '"proposed_rules": [{"rule_id": "rule_time_estimation_001", '
+    '"rule_text": "Pad DSA blocks by 15 min", "confidence": 0.55, '
+    '"source_date": "2026-02-28", "category": "time_estimation"}], '
+    '"encouragement": "Solid day: caf\\u00e9 \\ud83d\\ude00"}'
+)
+
+
+def test_colon_inside_truncated_string():
+    """A ':' inside a string value must not be mistaken for a key separator."""
+    repaired = _repair_truncated_json('{"observations": ["Start at 10:30, then: rest", "Lab at 14:')
+    assert orjson.loads(repaired) == {"observations": ["Start at 10:30, then: rest", "Lab at 14:"]}
+
+
+def test_dangling_key_is_dropped():
+    repaired = _repair_truncated_json('{"a": "x: y", "b')
+    assert orjson.loads(repaired) == {"a": "x: y"}
+
+
+def test_dangling_colon_and_literal_are_dropped():
+    assert orjson.loads(_repair_truncated_json('{"a": 1, "b":')) == {"a": 1}
+    assert orjson.loads(_repair_truncated_json('{"a": 1, "b": tru')) == {"a": 1}
+
+
+def test_incomplete_unicode_escape_is_dropped():
+    assert orjson.loads(_repair_truncated_json('{"observations": ["caf\\u00')) == {"observations": ["caf"]}
+    # A high surrogate is only valid with its pair, so it goes too
+    assert orjson.loads(_repair_truncated_json('{"a": "ok \\ud83d\\ude')) == {"a": "ok "}
+
+
+def test_every_prefix_parses():
+    for end in range(1, len(SAMPLE) + 1):
+        orjson.loads(_repair_truncated_json(SAMPLE[:end]))
+
+
+def test_complete_json_is_untouched():
+    assert _repair_truncated_json(SAMPLE) == SAMPLE
@@ -0,0 +1,48 @@
+"""
+Single entry point for the manual test scripts:
+
+    python -m tests client-gemini     # test_client.py: raw Gemini structured output
+    python -m tests critic            # test_critic.py: Critic over the local history
+    python -m tests e2e [--cache]     # test_e2e.py: Actor-Critic loop against a running server
+
+Each script is imported only when its step is selected, so e.g. the e2e run
+never pays for google-genai / Critic construction.
+"""
+
+import argparse
+import asyncio
+import os
+
+
+def _client_gemini(args: argparse.Namespace) -> None:
+    import test_client
+    test_client.main()
+
+
+def _critic(args: argparse.Namespace) -> None:
+    import test_critic
+    test_critic.main()
+
+
+def _e2e(args: argparse.Namespace) -> None:
+    if args.cache:
+        os.environ["E2E_CACHE"] = "1"   # read by test_e2e at import
+    import test_e2e
+    asyncio.run(test_e2e.main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m tests", description="ChronoForge manual test runner")
+    steps = parser.add_subparsers(dest="step", required=True)
+    steps.add_parser("client-gemini", help="Generate a routine straight from Gemini").set_defaults(run=_client_gemini)
+    steps.add_parser("critic", help="Run the Critic over history_upadhyay_nisarg.jsonl").set_defaults(run=_critic)
+    e2e = steps.add_parser("e2e", help="Run the E2E loop against BASE_URL")
+    e2e.add_argument("--cache", action="store_true", help="Replay step 1 from the local routine response cache")
+    e2e.set_defaults(run=_e2e)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()